@@ -1,14 +1,20 @@
 # Day 9 – E-commerce Agent (ACP Style)
 # Store: The Agentic Store
-# Features: Catalog Browsing, Cart Management, Order Persistence (JSON)
+# Features: Catalog Browsing, Cart Management, Order Persistence (JSON Lines)
 
+import asyncio
+import functools
+import itertools
 import json
 import logging
 import os
-import uuid
+import re
+import secrets
+import threading
+import time
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import List, Dict, Optional, Annotated
+from datetime import datetime, timezone
+from typing import List, Dict, Iterator, Optional, Tuple, Annotated
 
 from dotenv import load_dotenv
 from pydantic import Field
@@ -92,80 +98,284 @@ CATALOG = [
     },
 ]
 
+# Search fields laid out as parallel per-field lists (index i is CATALOG[i]),
+# lowercased and split once at import so the search helpers only walk
+# plain lists of strings.
+_IDS = [p['id'] for p in CATALOG]
+_NAMES_LOWER = [p['name'].lower() for p in CATALOG]
+_DESCS_LOWER = [p['description'].lower() for p in CATALOG]
+_CATEGORIES = [p['category'] for p in CATALOG]
+# Name words of at least this length count as keywords (e.g. "hoodie",
+# "neural"); filtered once here rather than on every lookup.
+_MIN_KEYWORD_LEN = 4
+_KEYWORDS = [
+    tuple(k for k in name.split() if len(k) >= _MIN_KEYWORD_LEN)
+    for name in _NAMES_LOWER
+]
+_CATALOG_BY_ID = {p['id']: p for p in CATALOG}
+# Category -> catalog indices, so a category filter never scans other products.
+_BY_CATEGORY: Dict[str, List[int]] = {}
+for _i, _cat in enumerate(_CATEGORIES):
+    _BY_CATEGORY.setdefault(_cat, []).append(_i)
+_CATEGORIES_SET = frozenset(_BY_CATEGORY)
+
+def _build_term_index(
+    names: List[str], keywords: List[Tuple[str, ...]]
+) -> Tuple[Dict[str, Tuple[int, int]], re.Pattern]:
+    """Rank names (priority 0) and keywords (priority 1) by (priority, catalog
+    index) and build one pattern that finds all of them in a single scan."""
+    owner: Dict[str, Tuple[int, int]] = {}
+    for i, name in enumerate(names):
+        owner.setdefault(name, (0, i))
+    for i, words in enumerate(keywords):
+        for k in words:
+            owner.setdefault(k, (1, i))
+    # The scan reports only the longest term starting at each position, so
+    # fold in any shorter terms that are prefixes of it.
+    rank = {
+        t: min(r for other, r in owner.items() if t.startswith(other))
+        for t in owner
+    }
+    # Lookahead, so overlapping terms are all reported.
+    pattern = re.compile(
+        "(?=("
+        + "|".join(re.escape(t) for t in sorted(owner, key=len, reverse=True))
+        + "))"
+    )
+    return rank, pattern
+
+_TERM_RANK, _TERM_RE = _build_term_index(_NAMES_LOWER, _KEYWORDS)
+# Keywords that a single mis-heard word may be corrected to. Short keywords
+# ("pack", "tech") and punctuated ones ("(black)") are left out: too many
+# ordinary words sit one edit away from them.
+_FUZZY_MIN_TERM_LEN = 6
+_FUZZY_TERMS = sorted({
+    k for keywords in _KEYWORDS for k in keywords
+    if len(k) >= _FUZZY_MIN_TERM_LEN and k.isalpha()
+})
+# A dropped or added letter is only trusted on keywords this long; shorter
+# ones have real-word neighbours ("neural" / "neutral").
+_FUZZY_MIN_INDEL_LEN = 8
+# Leading words ignored when deciding whether a reference is a single word.
+_FILLER_WORDS = frozenset({"a", "an", "the"})
+# Shortest reference that could contain any product name or keyword.
+_MIN_REF_LEN = min(
+    min((len(k) for k in keywords), default=len(name))
+    for name, keywords in zip(_NAMES_LOWER, _KEYWORDS)
+)
+
 # -------------------------
-# 2. Persistence (JSON)
+# 2. Persistence (JSON Lines)
 # -------------------------
-ORDERS_FILE = "orders.json"
+# One JSON-encoded order per line, so saving an order is a single append
+# instead of re-reading and re-writing the whole history.
+# The file is created by the first append; nothing is touched at import.
+ORDERS_FILE = "orders.jsonl"
 
-# Ensure orders file exists
-if not os.path.exists(ORDERS_FILE):
-    with open(ORDERS_FILE, "w") as f:
-        json.dump([], f)
+# Most recent order saved by this process; lets get_last_order skip the disk.
+_LAST_ORDER: Optional[Dict] = None
 
-def _load_all_orders() -> List[Dict]:
+def _iter_orders() -> Iterator[Dict]:
+    """Stream saved orders, skipping lines that don't parse (e.g. a torn write)."""
     try:
-        with open(ORDERS_FILE, "r") as f:
-            return json.load(f)
-    except Exception:
-        return []
+        f = open(ORDERS_FILE, "r")
+    except FileNotFoundError:
+        return
+    with f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {lineno} in {ORDERS_FILE}")
+
+# Each event loop has its own writer (see _order_writers), so saves from
+# several jobs in one process can overlap in worker threads; the lock keeps
+# them from interleaving. Across processes, each batch goes out as a single
+# O_APPEND write, which the OS places atomically at the end of the file.
+_ORDERS_LOCK = threading.Lock()
+
+def _save_orders(orders: List[Dict]):
+    data = "".join(json.dumps(order) + "\n" for order in orders).encode()
+    with _ORDERS_LOCK:
+        fd = os.open(ORDERS_FILE, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # A crash can leave the last line torn; start on a fresh line so
+            # the new orders don't get glued onto it.
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+def _read_last_order() -> Optional[Dict]:
+    last = None
+    for last in _iter_orders():
+        pass
+    return last
 
-def _save_order(order: Dict):
-    orders = _load_all_orders()
-    orders.append(order)
-    with open(ORDERS_FILE, "w") as f:
-        json.dump(orders, f, indent=2)
+# Orders are persisted by a single background writer so the blocking file
+# write never runs on the event loop that is handling the conversation.
+# Orders arriving close together are written in one append: a batch is
+# flushed once it holds _FLUSH_MAX_ORDERS orders or _FLUSH_INTERVAL seconds
+# after its first order, which bounds how much a crash can lose.
+_FLUSH_MAX_ORDERS = 16
+_FLUSH_INTERVAL = 1.0
+
+# One queue and writer task per event loop: an asyncio.Queue only works on
+# the loop it is used from, and jobs may run on separate loops in one process.
+_order_writers: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Queue, asyncio.Task]] = {}
+
+async def _order_writer(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + _FLUSH_INTERVAL
+        while len(batch) < _FLUSH_MAX_ORDERS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await asyncio.to_thread(_save_orders, batch)
+        except Exception:
+            ids = ", ".join(order["order_id"] for order in batch)
+            logger.exception(f"Failed to save orders {ids}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+def _start_order_writer() -> asyncio.Queue:
+    loop = asyncio.get_running_loop()
+    writer = _order_writers.get(loop)
+    if writer is None:
+        # Forget writers of loops that ended without a flush.
+        for stale in [other for other in _order_writers if other.is_closed()]:
+            del _order_writers[stale]
+        queue = asyncio.Queue()
+        writer = _order_writers[loop] = (queue, loop.create_task(_order_writer(queue)))
+    return writer[0]
+
+def _enqueue_order(order: Dict):
+    global _LAST_ORDER
+    _LAST_ORDER = order
+    _start_order_writer().put_nowait(order)
+
+async def _flush_orders():
+    """Write out everything queued on this loop and stop its writer."""
+    writer = _order_writers.pop(asyncio.get_running_loop(), None)
+    if writer is None:
+        return
+    queue, task = writer
+    await queue.join()
+    task.cancel()
 
 # -------------------------
 # 3. User Session State
 # -------------------------
 @dataclass
 class Userdata:
-    cart: List[Dict] = field(default_factory=list)  # list of {product_id, quantity, attrs}
+    cart: List[Dict] = field(default_factory=list)  # list of {product_id, name, quantity, size, unit_price}
+    cart_total: int = 0  # kept in step with cart by add_to_cart / place_order
 
 # -------------------------
 # 4. Helper Logic
 # -------------------------
-def list_products(query: str = None, category: str = None) -> List[Dict]:
-    results = []
-    for p in CATALOG:
-        match = True
-        if category and p['category'] != category:
-            match = False
-        if query:
-            q = query.lower()
-            if q not in p['name'].lower() and q not in p['description'].lower():
-                match = False
-        if match:
-            results.append(p)
-    return results
+_MIN_QUERY_LEN = 3
+
+def list_products(query: str = None, category: str = None) -> Iterator[Dict]:
+    q = query.lower() if query else None
+    # One- or two-letter queries match nearly every description, so only
+    # accept exact name/category matches for those.
+    exact_only = q is not None and len(q) < _MIN_QUERY_LEN
+    if category:
+        if category not in _CATEGORIES_SET:
+            return
+        indices = _BY_CATEGORY[category]
+        if not q:
+            yield from (CATALOG[i] for i in indices)
+            return
+    else:
+        indices = range(len(CATALOG))
+    for i in indices:
+        if exact_only:
+            if q != _NAMES_LOWER[i] and q != _CATEGORIES[i]:
+                continue
+        elif q and q not in _NAMES_LOWER[i] and q not in _DESCS_LOWER[i]:
+            continue
+        yield CATALOG[i]
 
 def find_product_fuzzy(ref_text: str) -> Optional[Dict]:
     """Simple logic to find a product based on user speech."""
-    ref = ref_text.lower()
-    
+    pid = _find_product_id(ref_text.lower())
+    return _CATALOG_BY_ID.get(pid) if pid else None
+
+# CATALOG never changes at runtime, so lookups can be cached for the
+# lifetime of the process; spoken references repeat a lot within a session.
+@functools.lru_cache(maxsize=256)
+def _find_product_id(ref: str) -> Optional[str]:
     # 1. Try exact ID
-    for p in CATALOG:
-        if p['id'] == ref: return p
+    if ref in _CATALOG_BY_ID:
+        return ref
 
-    # 2. Try Name contains
-    for p in CATALOG:
-        if p['name'].lower() in ref: return p
-    
-    # 3. Try keywords (e.g. "the hoodie", "the mug")
-    for p in CATALOG:
-        keywords = p['name'].lower().split()
-        if any(k in ref for k in keywords if len(k) > 3):
-            return p
-            
+    # Too short to contain a name or keyword; skip the scan.
+    if len(ref) < _MIN_REF_LEN:
+        return None
+
+    # 2. Names, then keywords (e.g. "the hoodie", "the mug"), in one scan;
+    # earliest product wins within each.
+    ranks = [_TERM_RANK[m.group(1)] for m in _TERM_RE.finditer(ref)]
+    if ranks:
+        return _IDS[min(ranks)[1]]
+
+    # 3. A single mis-heard keyword ("nueral", "the devloper"). Only tried
+    # when the reference is one word, and only if exactly one keyword is a
+    # near miss, since a wrong guess silently adds the wrong product.
+    words = [w for w in ref.split() if w not in _FILLER_WORDS]
+    if len(words) == 1:
+        candidates = [t for t in _FUZZY_TERMS if _is_near_miss(words[0], t)]
+        if len(candidates) == 1:
+            return _IDS[_TERM_RANK[candidates[0]][1]]
     return None
 
-def calculate_total(cart):
-    total = 0
-    for item in cart:
-        p = next((x for x in CATALOG if x["id"] == item["product_id"]), None)
-        if p:
-            total += p["price"] * item["quantity"]
-    return total
+def _is_near_miss(word: str, term: str) -> bool:
+    """True if word is term with two adjacent letters swapped or, for long
+    terms, with one letter dropped or added."""
+    if len(word) == len(term):
+        diff = [i for i, (a, b) in enumerate(zip(word, term)) if a != b]
+        return (
+            len(diff) == 2
+            and diff[1] == diff[0] + 1
+            and word[diff[0]] == term[diff[1]]
+            and word[diff[1]] == term[diff[0]]
+        )
+    if len(term) < _FUZZY_MIN_INDEL_LEN or abs(len(word) - len(term)) != 1:
+        return False
+    short, long = sorted((word, term), key=len)
+    return any(long[:i] + long[i + 1:] == short for i in range(len(long)))
+
+# The reply depends only on (query, category) and CATALOG never changes.
+@functools.lru_cache(maxsize=64)
+def _render_catalog(query: Optional[str], category: Optional[str]) -> str:
+    matches = list_products(query, category)
+    products = list(itertools.islice(matches, 5))  # Limit to 5 for voice clarity
+    if not products:
+        return "I couldn't find any items matching that description."
+    
+    count = len(products) + sum(1 for _ in matches)
+    lines = [f"Found {count} items in The Agentic Store:"]
+    for p in products:
+        lines.append(f"- {p['name']} ({p['price']} INR)")
+    
+    return "\n".join(lines) + "\n\nWhich one would you like to add to your cart?"
+
+def _iso_now() -> str:
+    return datetime.fromtimestamp(time.time(), tz=timezone.utc).isoformat(timespec="seconds")
 
 # -------------------------
 # 5. Agent Tools
@@ -178,15 +388,7 @@ async def show_catalog(
     category: Annotated[Optional[str], Field(description="Category (apparel, accessories)")] = None,
 ) -> str:
     """Browse the store catalog."""
-    products = list_products(query, category)
-    if not products:
-        return "I couldn't find any items matching that description."
-    
-    lines = [f"Found {len(products)} items in The Agentic Store:"]
-    for p in products[:5]: # Limit to 5 for voice clarity
-        lines.append(f"- {p['name']} ({p['price']} INR)")
-    
-    return "\n".join(lines) + "\n\nWhich one would you like to add to your cart?"
+    return _render_catalog(query, category)
 
 @function_tool
 async def add_to_cart(
@@ -200,14 +402,17 @@ async def add_to_cart(
     if not product:
         return f"I'm not sure which product you meant by '{product_ref}'. Could you be more specific?"
     
-    ctx.userdata.cart.append({
+    item = {
         "product_id": product["id"],
         "name": product["name"],
         "quantity": quantity,
-        "size": size
-    })
+        "size": size,
+        "unit_price": product["price"],
+    }
+    ctx.userdata.cart.append(item)
+    ctx.userdata.cart_total += item["unit_price"] * item["quantity"]
     
-    return f"Added {quantity} x {product['name']} to your cart. Cart Total: {calculate_total(ctx.userdata.cart)} INR."
+    return f"Added {quantity} x {product['name']} to your cart. Cart Total: {ctx.userdata.cart_total} INR."
 
 @function_tool
 async def view_cart(ctx: RunContext[Userdata]) -> str:
@@ -220,7 +425,7 @@ async def view_cart(ctx: RunContext[Userdata]) -> str:
         details = f"Size: {item['size']}" if item['size'] else ""
         lines.append(f"- {item['quantity']} x {item['name']} {details}")
     
-    lines.append(f"Total: {calculate_total(ctx.userdata.cart)} INR")
+    lines.append(f"Total: {ctx.userdata.cart_total} INR")
     return "\n".join(lines)
 
 @function_tool
@@ -229,33 +434,42 @@ async def place_order(ctx: RunContext[Userdata]) -> str:
     if not ctx.userdata.cart:
         return "You cannot place an empty order."
     
-    order_id = f"ORD-{str(uuid.uuid4())[:6].upper()}"
-    total = calculate_total(ctx.userdata.cart)
+    order_id = f"ORD-{secrets.token_hex(3).upper()}"
+    total = ctx.userdata.cart_total
     
     order_data = {
         "order_id": order_id,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": _iso_now(),
         "items": ctx.userdata.cart,
         "total_amount": total,
         "currency": "INR",
         "status": "CONFIRMED"
     }
     
-    _save_order(order_data)
+    _enqueue_order(order_data)
     
     # Clear cart
     ctx.userdata.cart = []
+    ctx.userdata.cart_total = 0
     
     return f"Order placed successfully! Your Order ID is {order_id}. Total amount: {total} INR. Is there anything else I can help you with?"
 
 @function_tool
 async def get_last_order(ctx: RunContext[Userdata]) -> str:
     """Fetch the most recent order details."""
-    orders = _load_all_orders()
-    if not orders:
+    global _LAST_ORDER
+    last = _LAST_ORDER
+    if last is None:
+        # Only the first lookup in a process reads the file; keep it off the loop.
+        last = await asyncio.to_thread(_read_last_order)
+        # An order placed while the file was being read is newer; keep it.
+        if _LAST_ORDER is None:
+            _LAST_ORDER = last
+        else:
+            last = _LAST_ORDER
+    if not last:
         return "You haven't placed any orders yet."
     
-    last = orders[-1]
     return f"Your last order ({last['order_id']}) contained {len(last['items'])} items for a total of {last['total_amount']} INR."
 
 # -------------------------
@@ -284,13 +498,25 @@ class CommerceAgent(Agent):
 # 7. Entrypoint
 # -------------------------
 def prewarm(proc: JobProcess):
-    try: proc.userdata["vad"] = silero.VAD.load()
-    except: pass
+    # These pin the current livekit-plugins-silero defaults, so a plugin
+    # upgrade can't silently change turn timing; they are not tuned values.
+    try:
+        proc.userdata["vad"] = silero.VAD.load(
+            min_speech_duration=0.05,
+            min_silence_duration=0.55,
+            activation_threshold=0.5,
+            sample_rate=16000,
+        )
+    except Exception:
+        logger.exception("Failed to load Silero VAD; continuing without it")
 
 async def entrypoint(ctx: JobContext):
     ctx.log_context_fields = {"room": ctx.room.name}
     logger.info("🚀 STARTING AGENTIC COMMERCE STORE")
 
+    _start_order_writer()
+    ctx.add_shutdown_callback(_flush_orders)
+
     userdata = Userdata()
 
     session = AgentSession(
@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+
+import agent
+
+
+async def test_cart_total_follows_stored_unit_prices() -> None:
+    """The running total is the sum of unit_price * quantity over the cart."""
+    ctx = SimpleNamespace(userdata=agent.Userdata())
+
+    await agent.add_to_cart(ctx, "the hoodie", 2)
+    await agent.add_to_cart(ctx, "neural network mug", 1)
+
+    cart = ctx.userdata.cart
+    assert ctx.userdata.cart_total == sum(i["unit_price"] * i["quantity"] for i in cart)
+    assert ctx.userdata.cart_total == 2 * 1499 + 499
@@ -0,0 +1,121 @@
+import pytest
+
+import agent
+
+
+def _product_id(ref: str):
+    product = agent.find_product_fuzzy(ref)
+    return product["id"] if product else None
+
+
+def _best(rank, term_re, ref: str):
+    ranks = [rank[m.group(1)] for m in term_re.finditer(ref)]
+    return min(ranks) if ranks else None
+
+
+@pytest.mark.parametrize(
+    ("ref", "expected"),
+    [
+        ("mug-neural", "mug-neural"),
+        ("TEE-ACP-WHT", "tee-acp-wht"),
+        # A contained name beats a keyword of an earlier product.
+        ("a hoodie and a neural network mug", "mug-neural"),
+        # Among keywords, the earliest catalog product wins.
+        ("the neural hoodie", "hoodie-dev-blk"),
+        ("stack of stickers", "cap-tech"),
+        ("the hoodie", "hoodie-dev-blk"),
+        ("Laptop Sticker Pack please", "sticker-pack"),
+        ("something else", None),
+    ],
+)
+def test_find_product_fuzzy(ref: str, expected) -> None:
+    assert _product_id(ref) == expected
+
+
+def test_refs_shorter_than_any_term_do_not_match() -> None:
+    assert _product_id("cap") is None
+    assert _product_id("mug") is None
+
+
+def test_term_index_folds_prefix_keywords() -> None:
+    """A keyword hidden inside a longer match at the same position still counts."""
+    rank, term_re = agent._build_term_index(["aaa", "bbb"], [("network",), ("networks",)])
+    assert _best(rank, term_re, "networks") == (1, 0)
+
+
+def test_term_index_sees_overlapping_keywords() -> None:
+    rank, term_re = agent._build_term_index(["aaa", "bbb"], [("tackle",), ("stack",)])
+    assert _best(rank, term_re, "stackle") == (1, 0)
+
+
+def test_term_index_prefers_names_over_keywords() -> None:
+    rank, term_re = agent._build_term_index(["blue mug", "red cap"], [("blue",), ("red",)])
+    assert _best(rank, term_re, "blue and red cap") == (0, 1)
+
+
+def _ids(query=None, category=None):
+    return [p["id"] for p in agent.list_products(query, category)]
+
+
+def test_list_products_short_query_needs_exact_match() -> None:
+    assert _ids("e") == []
+    assert _ids("mu") == []
+    assert _ids("mug") == ["mug-neural"]
+
+
+def test_list_products_unknown_category_is_empty() -> None:
+    assert _ids(category="food") == []
+    assert _ids("mug", "food") == []
+
+
+def test_list_products_category_only() -> None:
+    assert _ids(category="apparel") == ["hoodie-dev-blk", "tee-acp-wht"]
+    assert _ids(category="accessories") == ["mug-neural", "cap-tech", "sticker-pack"]
+
+
+def test_list_products_query_within_category() -> None:
+    assert _ids("cotton", "apparel") == ["hoodie-dev-blk"]
+    assert _ids("mug", "apparel") == []
+    assert len(_ids()) == len(agent.CATALOG)
+
+
+@pytest.mark.parametrize(
+    ("ref", "expected"),
+    [
+        ("nueral", "mug-neural"),
+        ("the nueral", "mug-neural"),
+        ("devloper", "hoodie-dev-blk"),
+        ("a netwrok", "mug-neural"),
+    ],
+)
+def test_misheard_keywords_are_corrected(ref: str, expected: str) -> None:
+    assert _product_id(ref) == expected
+
+
+@pytest.mark.parametrize(
+    "ref",
+    [
+        "the natural color tee",
+        "white tee in a general size",
+        "the thicker cap",
+        "a ticket",
+        "the sticky notes",
+        "the envelope",
+        "general",
+        "natural",
+        "funeral",
+        "rural",
+        "mural",
+        "numeral",
+        "neutral",
+        "kicker",
+        "picker",
+        "wicker",
+        "slicker",
+        "tickets",
+        "sticks",
+    ],
+)
+def test_nearby_ordinary_words_are_not_corrected(ref: str) -> None:
+    """Words close to a keyword must not silently pick a product."""
+    assert _product_id(ref) is None
@@ -0,0 +1,163 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import agent
+
+
+@pytest.fixture
+def orders_file(tmp_path, monkeypatch):
+    path = tmp_path / "orders.jsonl"
+    monkeypatch.setattr(agent, "ORDERS_FILE", str(path))
+    monkeypatch.setattr(agent, "_LAST_ORDER", None)
+    return path
+
+
+def _order(order_id: str) -> dict:
+    return {"order_id": order_id, "items": [], "total_amount": 0}
+
+
+def test_unreadable_line_does_not_hide_later_orders(orders_file) -> None:
+    """A bad line is skipped instead of ending the read."""
+    orders_file.write_text(
+        json.dumps(_order("ORD-1")) + "\n" + "{garbage\n" + json.dumps(_order("ORD-3")) + "\n"
+    )
+
+    assert [o["order_id"] for o in agent._iter_orders()] == ["ORD-1", "ORD-3"]
+    assert agent._read_last_order()["order_id"] == "ORD-3"
+
+
+def test_missing_file_has_no_orders(orders_file) -> None:
+    assert list(agent._iter_orders()) == []
+    assert agent._read_last_order() is None
+
+
+def test_save_after_torn_line_starts_a_new_line(orders_file) -> None:
+    """An append after a crash mid-write does not corrupt the new order."""
+    orders_file.write_text(json.dumps(_order("ORD-1")) + "\n" + '{"order_id": "ORD-TO')
+
+    agent._save_orders([_order("ORD-2")])
+
+    assert [o["order_id"] for o in agent._iter_orders()] == ["ORD-1", "ORD-2"]
+    assert orders_file.read_text().endswith("\n")
+
+
+def test_orders_from_separate_event_loops_are_all_saved(orders_file, monkeypatch) -> None:
+    """Each loop gets its own writer, so no loop enqueues onto a dead queue."""
+    monkeypatch.setattr(agent, "_FLUSH_INTERVAL", 0.01)
+
+    async def job(order_id: str) -> None:
+        agent._enqueue_order(_order(order_id))
+        await agent._flush_orders()
+
+    asyncio.run(job("ORD-A"))
+    asyncio.run(job("ORD-B"))
+
+    assert [o["order_id"] for o in agent._iter_orders()] == ["ORD-A", "ORD-B"]
+    assert agent._order_writers == {}
+
+
+async def test_get_last_order_keeps_order_placed_during_file_read(orders_file, monkeypatch) -> None:
+    """The cold-cache file read must not overwrite an order placed meanwhile."""
+
+    def read_while_order_is_placed():
+        agent._LAST_ORDER = _order("ORD-NEW")
+        return _order("ORD-OLD")
+
+    monkeypatch.setattr(agent, "_read_last_order", read_while_order_is_placed)
+    ctx = SimpleNamespace(userdata=agent.Userdata())
+
+    assert "ORD-NEW" in await agent.get_last_order(ctx)
+    assert agent._LAST_ORDER["order_id"] == "ORD-NEW"
+
+
+async def test_get_last_order_caches_file_result(orders_file) -> None:
+    orders_file.write_text(json.dumps(_order("ORD-1")) + "\n")
+    ctx = SimpleNamespace(userdata=agent.Userdata())
+
+    assert "ORD-1" in await agent.get_last_order(ctx)
+    assert agent._LAST_ORDER["order_id"] == "ORD-1"
+
+
+def test_large_batch_is_one_append_write(orders_file, monkeypatch) -> None:
+    """Batches bigger than a stdio buffer still go out in a single write."""
+    writes = []
+    real_write = agent.os.write
+
+    def counting_write(fd, data):
+        writes.append(len(data))
+        return real_write(fd, data)
+
+    monkeypatch.setattr(agent.os, "write", counting_write)
+    batch = [dict(_order(f"ORD-{i}"), note="x" * 1024) for i in range(16)]
+
+    agent._save_orders(batch)
+
+    assert len(writes) == 1 and writes[0] > 8192
+    assert len(list(agent._iter_orders())) == 16
+
+
+@pytest.fixture
+async def saved_batches(orders_file, monkeypatch):
+    """Batches handed to _save_orders, delivered back on the test's loop."""
+    loop = asyncio.get_running_loop()
+    batches: asyncio.Queue = asyncio.Queue()
+
+    def save(orders):
+        loop.call_soon_threadsafe(batches.put_nowait, [o["order_id"] for o in orders])
+
+    monkeypatch.setattr(agent, "_save_orders", save)
+    return batches
+
+
+async def _next_batch(batches: asyncio.Queue) -> list:
+    return await asyncio.wait_for(batches.get(), timeout=10)
+
+
+async def test_writer_flushes_every_16_orders(saved_batches, monkeypatch) -> None:
+    """A full batch is written on its own; the rest goes out on flush."""
+    monkeypatch.setattr(agent, "_FLUSH_INTERVAL", 0.5)
+    for i in range(20):
+        agent._enqueue_order(_order(str(i)))
+
+    assert await _next_batch(saved_batches) == [str(i) for i in range(16)]
+
+    await asyncio.wait_for(agent._flush_orders(), timeout=10)
+    assert await _next_batch(saved_batches) == ["16", "17", "18", "19"]
+    assert saved_batches.empty()
+    assert asyncio.get_running_loop() not in agent._order_writers
+
+
+async def test_writer_flushes_partial_batch_after_interval(saved_batches, monkeypatch) -> None:
+    """A batch that never fills is written once the flush interval has passed."""
+    monkeypatch.setattr(agent, "_FLUSH_INTERVAL", 0.2)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    agent._enqueue_order(_order("A"))
+    agent._enqueue_order(_order("B"))
+
+    assert await _next_batch(saved_batches) == ["A", "B"]
+    assert loop.time() - started >= agent._FLUSH_INTERVAL
+    await asyncio.wait_for(agent._flush_orders(), timeout=10)
+
+
+async def test_failed_save_still_marks_orders_done(orders_file, monkeypatch) -> None:
+    """A save error is logged, the queue still drains, and the writer keeps going."""
+    monkeypatch.setattr(agent, "_FLUSH_INTERVAL", 0.01)
+    saved = []
+
+    def save(orders):
+        if orders[0]["order_id"] == "BAD":
+            raise OSError("disk full")
+        saved.extend(o["order_id"] for o in orders)
+
+    monkeypatch.setattr(agent, "_save_orders", save)
+    agent._enqueue_order(_order("BAD"))
+    queue = agent._order_writers[asyncio.get_running_loop()][0]
+    await asyncio.wait_for(queue.join(), timeout=10)
+
+    agent._enqueue_order(_order("GOOD"))
+    await asyncio.wait_for(agent._flush_orders(), timeout=10)
+    assert saved == ["GOOD"]